@@ -0,0 +1,246 @@
+import asyncio
+import json
+import threading
+import time
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+
+def new_conversation():
+    """Create empty conversation state: chat history, tool result cache and a lock"""
+    return {"messages": [], "tool_cache": {}, "lock": threading.Lock()}
+
+
+async def _with_session(mcp_url, fn):
+    """Open one MCP session, run fn(session) and close it again"""
+    async with streamablehttp_client(mcp_url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            return await fn(session)
+
+
+def list_tools(mcp_url):
+    """Fetch the MCP server's tools as OpenAI tool definitions"""
+    async def _list(session):
+        result = await session.list_tools()
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description or "",
+                    "parameters": tool.inputSchema,
+                },
+            }
+            for tool in result.tools
+        ]
+
+    return asyncio.run(_with_session(mcp_url, _list))
+
+
+def _error(message):
+    return False, json.dumps({"error": message})
+
+
+def _reports_error(text):
+    """True if a tool returned an {"error": ...} payload instead of raising"""
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(payload, dict) and "error" in payload
+
+
+async def _call_tool(session, name, arguments):
+    """Call a single MCP tool and return (ok, text) for the model"""
+    try:
+        result = await session.call_tool(name, arguments)
+    except Exception as e:
+        return _error(str(e))
+
+    text = "\n".join(
+        part.text for part in result.content if getattr(part, "text", None) is not None
+    )
+    if result.isError:
+        return _error(text or f"Tool '{name}' failed")
+    return not _reports_error(text), text
+
+
+def call_tools(mcp_url, calls):
+    """
+    Run several (name, arguments) tool calls concurrently over one MCP session.
+    Returns one (ok, text) pair per call; never raises, so a dead MCP server
+    becomes an error result the model can read.
+    """
+    async def _call_all(session):
+        return await asyncio.gather(
+            *(_call_tool(session, name, arguments) for name, arguments in calls)
+        )
+
+    try:
+        return asyncio.run(_with_session(mcp_url, _call_all))
+    except Exception as e:
+        # Unwrap the transport's task group errors to report the actual cause
+        while getattr(e, "exceptions", None):
+            e = e.exceptions[0]
+        return [_error(f"MCP server unavailable: {e}")] * len(calls)
+
+
+def _cache_key(name, arguments):
+    return f"{name}:{json.dumps(arguments, sort_keys=True)}"
+
+
+def _parse_arguments(raw):
+    """Decode tool call arguments; None if the model sent invalid JSON"""
+    try:
+        arguments = json.loads(raw or "{}")
+    except json.JSONDecodeError:
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+
+def _stream_turn(client, request):
+    """
+    Stream one model turn, yielding delta events.
+    Returns (answer, tool_calls, seconds) where seconds only counts time spent
+    waiting on the model, not time suspended while the caller sends deltas.
+    """
+    answer = ""
+    pending = {}
+
+    started = time.perf_counter()
+    stream = client.chat.completions.create(**request)
+    seconds = time.perf_counter() - started
+
+    while True:
+        started = time.perf_counter()
+        chunk = next(stream, None)
+        seconds += time.perf_counter() - started
+        if chunk is None:
+            break
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            answer += delta.content
+            yield {"type": "delta", "content": delta.content}
+        for tool_call in delta.tool_calls or []:
+            slot = pending.setdefault(
+                tool_call.index, {"id": "", "name": "", "arguments": ""}
+            )
+            if tool_call.id:
+                slot["id"] = tool_call.id
+            if tool_call.function:
+                slot["name"] += tool_call.function.name or ""
+                slot["arguments"] += tool_call.function.arguments or ""
+
+    return answer, [pending[index] for index in sorted(pending)], seconds
+
+
+def run_agent(client, model, conversation, user_message, tools, mcp_url, max_turns=5):
+    """
+    Tool-calling loop for one user message.
+
+    Streams the model's answer and runs every tool call from a model turn
+    concurrently, reusing successful results already cached in the conversation.
+    New messages are only added to the conversation once the answer is complete,
+    so a failed request leaves its history untouched.
+    Yields event dicts:
+      {"type": "delta", "content": ...}           partial answer text
+      {"type": "tool_call", "name", "arguments", "cached"}
+      {"type": "limit", "max_turns"}              turn limit hit, answering without tools
+      {"type": "done", "response", "timing"}      final answer and latency split
+    """
+    cache = conversation["tool_cache"]
+    turn = [{"role": "user", "content": user_message}]
+
+    model_seconds = 0.0
+    tool_seconds = 0.0
+    started = time.perf_counter()
+
+    for _ in range(max_turns):
+        # Step 1: Stream one model turn, collecting text and tool calls
+        request = {"model": model, "messages": conversation["messages"] + turn, "stream": True}
+        if tools:
+            request["tools"] = tools
+
+        answer, calls, seconds = yield from _stream_turn(client, request)
+        model_seconds += seconds
+
+        if not calls:
+            break
+
+        # Step 2: Record the assistant's tool calls
+        for i, call in enumerate(calls):
+            call["id"] = call["id"] or f"call_{len(conversation['messages']) + len(turn)}_{i}"
+        turn.append({
+            "role": "assistant",
+            "content": answer or None,
+            "tool_calls": [
+                {
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call["arguments"]},
+                }
+                for call in calls
+            ],
+        })
+
+        # Step 3: Run uncached calls concurrently, once per distinct (name, arguments)
+        results = {}
+        missing = {}
+        keyed = []
+        for call in calls:
+            arguments = _parse_arguments(call["arguments"])
+            if arguments is None:
+                key = f"{call['id']}:invalid"
+                results[key] = _error(f"Invalid JSON arguments: {call['arguments']}")
+            else:
+                key = _cache_key(call["name"], arguments)
+                if key in cache:
+                    results[key] = (True, cache[key])
+                else:
+                    missing[key] = (call["name"], arguments)
+            keyed.append((call, key))
+            yield {
+                "type": "tool_call",
+                "name": call["name"],
+                "arguments": arguments if arguments is not None else call["arguments"],
+                "cached": key in cache,
+            }
+
+        if missing:
+            tool_started = time.perf_counter()
+            outcomes = call_tools(mcp_url, list(missing.values()))
+            tool_seconds += time.perf_counter() - tool_started
+            results.update(zip(missing.keys(), outcomes))
+            # Only successful results are cached; errors are retried next time
+            cache.update((key, text) for key, (ok, text) in results.items() if ok)
+
+        # Step 4: Feed results back for the next model turn
+        for call, key in keyed:
+            turn.append({
+                "role": "tool",
+                "tool_call_id": call["id"],
+                "content": results[key][1],
+            })
+    else:
+        # Step 5: Turn limit reached with tool calls pending; ask for an answer without tools
+        yield {"type": "limit", "max_turns": max_turns}
+        request = {"model": model, "messages": conversation["messages"] + turn, "stream": True}
+        answer, _, seconds = yield from _stream_turn(client, request)
+        model_seconds += seconds
+
+    turn.append({"role": "assistant", "content": answer})
+    conversation["messages"].extend(turn)
+
+    yield {
+        "type": "done",
+        "response": answer,
+        "timing": {
+            "model_seconds": round(model_seconds, 3),
+            "tool_seconds": round(tool_seconds, 3),
+            "total_seconds": round(time.perf_counter() - started, 3),
+        },
+    }
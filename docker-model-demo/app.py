@@ -1,6 +1,12 @@
 import os
+import json
+import threading
+import uuid
+from collections import OrderedDict
 import openai
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
+
+from agent import list_tools, new_conversation, run_agent
 
 app = Flask(__name__)
 
@@ -8,6 +14,8 @@ app = Flask(__name__)
 BASE_URL = os.getenv('BASE_URL', 'http://host.docker.internal:50000/engines/llama.cpp/v1/')
 MODEL = os.getenv('MODEL', 'ai/smollm2')
 API_KEY = os.getenv('API_KEY', 'dockermodelrunner')
+MCP_URL = os.getenv('MCP_URL', 'http://host.docker.internal:8000/mcp')
+MAX_CONVERSATIONS = int(os.getenv('MAX_CONVERSATIONS', '100'))
 
 # Initialize OpenAI client
 client = openai.OpenAI(
@@ -15,33 +23,95 @@ client = openai.OpenAI(
     api_key=API_KEY
 )
 
+# In-memory conversation state (history + tool result cache), keyed by id.
+# Least recently used conversations are dropped beyond MAX_CONVERSATIONS, and
+# each conversation serves one request at a time (see locked()).
+conversations = OrderedDict()
+conversations_lock = threading.Lock()
+tools = None
+
+def get_tools():
+    """Load MCP tools once; retry on the next request if the server is down"""
+    global tools
+    if tools is None:
+        try:
+            tools = list_tools(MCP_URL)
+        except Exception as e:
+            print(f"MCP tools unavailable at {MCP_URL}: {e}")
+            return []
+    return tools
+
+def get_conversation(conversation_id):
+    """Fetch or create a conversation, evicting the least recently used ones"""
+    with conversations_lock:
+        conversation = conversations.pop(conversation_id, None) or new_conversation()
+        conversations[conversation_id] = conversation
+        while len(conversations) > MAX_CONVERSATIONS:
+            conversations.popitem(last=False)
+        return conversation
+
+def locked(conversation, events):
+    """Run the agent events while holding the conversation's lock"""
+    if not conversation["lock"].acquire(blocking=False):
+        yield {"type": "error", "error": "Conversation is busy with another request"}
+        return
+    try:
+        yield from events
+    finally:
+        conversation["lock"].release()
+
+def start_agent(data):
+    """Resolve the conversation for a request and start the agent loop"""
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    conversation_id = str(data.get('conversation_id') or uuid.uuid4().hex)
+    conversation = get_conversation(conversation_id)
+    events = run_agent(
+        client, MODEL, conversation, data.get('message', 'Hello'), get_tools(), MCP_URL
+    )
+    return conversation_id, locked(conversation, events)
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Chat endpoint that accepts messages and returns AI response"""
     try:
-        data = request.get_json()
-        user_message = data.get('message', 'Hello')
-        
-        messages = [
-            {"role": "user", "content": user_message}
-        ]
-        
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=messages
-        )
+        conversation_id, events = start_agent(request.get_json(silent=True))
+        last = list(events)[-1]
+        if last["type"] == "error":
+            return jsonify({"error": last["error"]}), 409
         
         return jsonify({
-            "response": response.choices[0].message.content
+            "response": last["response"],
+            "conversation_id": conversation_id,
+            "timing": last["timing"]
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat endpoint: one JSON event per line (NDJSON)"""
+    try:
+        conversation_id, events = start_agent(request.get_json(silent=True))
+    except Exception as e:
+        error = json.dumps({"type": "error", "error": str(e)}) + "\n"
+        return Response(error, status=500, mimetype='application/x-ndjson')
+
+    def generate():
+        yield json.dumps({"type": "start", "conversation_id": conversation_id}) + "\n"
+        try:
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "model": MODEL})
+    return jsonify({"status": "healthy", "model": MODEL, "mcp_url": MCP_URL})
 
 @app.route('/', methods=['GET'])
 def home():
@@ -113,6 +183,11 @@ def home():
             color: #666; 
             font-style: italic; 
         }
+        .meta-message { 
+            color: #666; 
+            font-size: 0.85em; 
+            margin-right: 50px; 
+        }
     </style>
 </head>
 <body>
@@ -133,6 +208,11 @@ def home():
             messageDiv.textContent = content;
             messagesDiv.appendChild(messageDiv);
             messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            return messageDiv;
+        }
+
+        function addMeta(content) {
+            addMessage(content, false).className = 'message meta-message';
         }
 
         function addLoading() {
@@ -150,6 +230,34 @@ def home():
             if (loading) loading.remove();
         }
 
+        let conversationId = null;
+
+        function handleEvent(event, state) {
+            if (event.type === 'start') {
+                conversationId = event.conversation_id;
+            } else if (event.type === 'delta') {
+                removeLoading();
+                if (!state.answerDiv) state.answerDiv = addMessage('', false);
+                state.answerDiv.textContent += event.content;
+            } else if (event.type === 'tool_call') {
+                // Text streamed before a tool call is not the final answer
+                if (state.answerDiv) state.answerDiv.remove();
+                state.answerDiv = null;
+                addMeta('🔧 ' + event.name + ' ' + JSON.stringify(event.arguments) +
+                        (event.cached ? ' (cached)' : ''));
+            } else if (event.type === 'limit') {
+                addMeta('Tool call limit (' + event.max_turns + ' turns) reached, answering without tools');
+            } else if (event.type === 'done') {
+                removeLoading();
+                const t = event.timing;
+                addMeta('⏱ model ' + t.model_seconds + 's · tools ' + t.tool_seconds +
+                        's · total ' + t.total_seconds + 's');
+            } else if (event.type === 'error') {
+                removeLoading();
+                addMessage('Error: ' + event.error, false);
+            }
+        }
+
         async function sendMessage() {
             const input = document.getElementById('messageInput');
             const message = input.value.trim();
@@ -160,20 +268,28 @@ def home():
             addLoading();
 
             try {
-                const response = await fetch('/chat', {
+                const response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ message: message })
+                    body: JSON.stringify({ message: message, conversation_id: conversationId })
                 });
 
-                const data = await response.json();
-                removeLoading();
-                
-                if (data.error) {
-                    addMessage('Error: ' + data.error, false);
-                } else {
-                    addMessage(data.response, false);
+                // Read newline-delimited JSON events as they arrive
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                const state = { answerDiv: null };
+                let buffer = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    for (const line of lines) {
+                        if (line.trim()) handleEvent(JSON.parse(line), state);
+                    }
                 }
+                removeLoading();
             } catch (error) {
                 removeLoading();
                 addMessage('Error: ' + error.message, false);
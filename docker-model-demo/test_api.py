@@ -27,9 +27,34 @@ def test_chat():
     except Exception as e:
         print(f"Chat test failed: {e}")
 
+def test_chat_stream():
+    """Test streaming chat endpoint with weather tool calls"""
+    try:
+        data = {"message": "What's the weather in Paris and Tokyo?"}
+        response = requests.post(f"{API_URL}/chat/stream", json=data, stream=True)
+        print("Streaming Chat Test:")
+        print(f"Status: {response.status_code}")
+        for line in response.iter_lines():
+            if line:
+                event = json.loads(line)
+                if event["type"] == "delta":
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "tool_call":
+                    print(f"[tool] {event['name']} {event['arguments']} cached={event['cached']}")
+                elif event["type"] == "limit":
+                    print(f"[limit] {event['max_turns']} turns reached, answering without tools")
+                elif event["type"] == "done":
+                    print(f"\nTiming: {event['timing']}")
+                elif event["type"] == "error":
+                    print(f"Error: {event['error']}")
+        print()
+    except Exception as e:
+        print(f"Streaming chat test failed: {e}")
+
 if __name__ == "__main__":
     print("Testing Docker Model Runner API...")
     print("=" * 50)
     
     test_health()
     test_chat()
+    test_chat_stream()
@@ -1,14 +1,38 @@
+import asyncio
+import os
 import requests
 from mcp.server import FastMCP
+from mcp.server.transport_security import TransportSecuritySettings
 
-mcp = FastMCP("weather-mcp")
+HOST = os.getenv("MCP_HOST", "127.0.0.1")
+PORT = int(os.getenv("MCP_PORT", "8000"))
+
+# Host headers accepted by DNS rebinding protection. host.docker.internal lets
+# the containerized chat app (docker-model-demo) reach this server.
+ALLOWED_HOSTS = os.getenv(
+    "MCP_ALLOWED_HOSTS", "127.0.0.1:*,localhost:*,[::1]:*,host.docker.internal:*"
+).split(",")
+
+mcp = FastMCP(
+    "weather-mcp",
+    host=HOST,
+    port=PORT,
+    transport_security=TransportSecuritySettings(
+        allowed_hosts=ALLOWED_HOSTS,
+        allowed_origins=[f"http://{host}" for host in ALLOWED_HOSTS],
+    ),
+)
 
 @mcp.tool()
-def get_weather(city: str) -> dict:
+async def get_weather(city: str) -> dict:
     """
     Returns current temperature and weather conditions for a given city.
     Uses Open-Meteo's free API.
     """
+    # Run the blocking HTTP calls in a thread so concurrent tool calls overlap
+    return await asyncio.to_thread(fetch_weather, city)
+
+def fetch_weather(city: str) -> dict:
     try:
         # Step 1: Convert city to coordinates using Open-Meteo geocoding
         geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1"
@@ -55,6 +79,7 @@ def get_weather(city: str) -> dict:
 if __name__ == "__main__":
     print("Starting Weather MCP Server...")
     print("Transport: streamable-http")
-    print("Server will be available at http://127.0.0.1:8000")
-    print("MCP endpoint: http://127.0.0.1:8000/mcp")
+    print(f"Server will be available at http://{HOST}:{PORT}")
+    print(f"MCP endpoint: http://{HOST}:{PORT}/mcp")
+    print(f"Allowed Host headers: {', '.join(ALLOWED_HOSTS)}")
     mcp.run(transport="streamable-http")